@@ -20,18 +20,81 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
-import argparse
 import sys
 import os
-import json
-import binascii
 import re
+import functools
+import mmap
+import stat
+from typing import TYPE_CHECKING, Callable, Union
 
 from src.python.c0microsd.interface import C0microSDInterface
 
+if TYPE_CHECKING:
+    import argparse
+
+try:
+    # zlib-ng bindings are optional, and use (V)PCLMULQDQ folding for crc32
+    # on CPUs that support it.
+    from zlib_ng.zlib_ng import crc32 as _crc32_impl
+except ImportError:
+    try:
+        # zlib's crc32 processes several bytes per step (slice-by-N /
+        # folding, depending on the zlib build Python is linked against).
+        from zlib import crc32 as _crc32_impl
+    except ImportError:
+        from binascii import crc32 as _crc32_impl
+
+
 APP_VERSION = "1.2"  # Application version
 MAX_FLASH_ATTEMPTS = 5  # Maximum flashing attempts
 
+# Exit codes for exceptions escaping a command, checked in order
+_EXIT_CODES = (
+    (ValueError, os.EX_DATAERR),
+    (FileNotFoundError, os.EX_NOINPUT),
+    (PermissionError, os.EX_NOPERM),
+)
+
+# Zero-filled buffers written to the switch config and unlock sections
+_ZERO_512 = bytes(512)
+_ZERO_32 = bytes(32)
+
+# Markers delimiting the prefix section at the start of a bitstream
+_BITSTREAM_PREFIX_START_WORD = b'\xFF\x00'
+_BITSTREAM_PREFIX_END_WORD = b'\x00\xFF'
+
+# Size string format accepted by parse_size(), e.g. '512', '1K', '5M', '3g'
+_SIZE_RE = re.compile(r"(\d+)([KMGkmg]?)")
+# Left-shift applied to the size for each suffix
+_SIZE_SUFFIX_SHIFT = {'': 0, 'K': 10, 'M': 20, 'G': 30}
+
+
+def _json_loads(data: bytes) -> object:
+    """
+    Parses a JSON document, using orjson when it is installed. The parser
+    is imported on first use, since only the -i command needs it.
+
+    :param data: The raw JSON bytes
+    :return: The parsed document
+    """
+    try:
+        from orjson import loads
+    except ImportError:
+        from json import loads
+    return loads(data)
+
+
+def _crc32(data: bytes, value: int = 0) -> int:
+    """
+    Computes the (IEEE 802.3) crc32 checksum of a buffer.
+
+    :param data: Buffer to checksum
+    :param value: Running checksum of the preceding data
+    :return: Unsigned 32-bit checksum
+    """
+    return _crc32_impl(data, value) & 0xFFFFFFFF
+
 
 class C0microSDToolkit(C0microSDInterface):
     # 256 KiB offset for switch config
@@ -55,6 +118,23 @@ class C0microSDToolkit(C0microSDInterface):
 
     BOOTLOADER_UNLOCK_WORD = b"UBLD"
 
+    # Expected contents of the 5 x 32-byte warmboot section at offset 0
+    WARMBOOT_SECTION_TEMPLATE = bytes.fromhex(
+        "7eaa997e92000044030800008200000108000000000000000000000000000000"
+        "7eaa997e92000044030800008200000108000000000000000000000000000000"
+        "7eaa997e92000044031000008200000108000000000000000000000000000000"
+        "7eaa997e92000044031800008200000108000000000000000000000000000000"
+        "7eaa997e92000044030800008200000108000000000000000000000000000000"
+    )
+
+    # 64 KiB chunks for streaming reads of large regions
+    READ_CHUNK_SIZE = 0x10000
+    # 64 KiB (erase-block aligned) chunks for flashing large regions
+    WRITE_CHUNK_SIZE = 0x10000
+
+    # We assume that the prefix is never going to be larger than 4K
+    BITSTREAM_PREFIX_CHUNK_SIZE = 0x1000
+
     def _strip_trailing_bytes(
             self, byte_array: bytearray, byte: int
             ) -> bytearray:
@@ -65,10 +145,7 @@ class C0microSDToolkit(C0microSDInterface):
         :param byte (int): The byte to remove.
         :return (bytearray): Stripped array of bytes
         """
-        end = len(byte_array)
-        while end > 0 and byte_array[end - 1] == byte:
-            end -= 1
-        return byte_array[:end]
+        return byte_array.rstrip(bytes((byte,)))
 
     def switch_boot_config(self) -> None:
         """
@@ -89,7 +166,7 @@ class C0microSDToolkit(C0microSDInterface):
         elif self.force_transactions:
             print("Switching device boot mode...")
 
-        self._write(self.BOOTLOADER_SWITCH_CONFIG_OFFSET, bytes([0] * 512))
+        self._write(self.BOOTLOADER_SWITCH_CONFIG_OFFSET, _ZERO_512)
 
         print(
             "Device configured successfully. "
@@ -116,10 +193,70 @@ class C0microSDToolkit(C0microSDInterface):
         """
         self.get_status()
         print("Locking bootloader...")
-        self._write(self.BOOTLOADER_UNLOCK_OFFSET, bytes([0] * 32))
+        self._write(self.BOOTLOADER_UNLOCK_OFFSET, _ZERO_32)
+
+    def _verify_data(self, data: bytes, offset: int) -> bool:
+        """
+        Compares data against the device contents at offset, one chunk at a
+        time, stopping at the first mismatching chunk.
+
+        :param data: The expected data
+        :param offset: Device offset (in bytes) of the data
+        :return: True if the device contents match the data
+        """
+        data_view = memoryview(data)
+        position = 0
+        for chunk in self._iter_read(
+            offset, len(data_view), self.READ_CHUNK_SIZE
+        ):
+            if data_view[position:position + len(chunk)] != chunk:
+                return False
+            position += len(chunk)
+        return position == len(data_view)
+
+    def _check_flash_preconditions(self, file_data: bytes) -> None:
+        """
+        Checks that there is data to flash, and that the C0-microSD is in
+        Bootloader mode (unless transactions are forced).
+
+        :param file_data: A byte buffer with the data to be written
+        """
+        if len(file_data) == 0:
+            raise ValueError("Error: No data to flash, the input is empty.")
+
+        self.get_status()
+
+        if self.configuration != "bootloader" and not self.force_transactions:
+            raise RuntimeError(
+                "Error: device is not in Bootloader mode. "
+                "Switch to Bootloader mode and try again"
+            )
+
+    def data_is_up_to_date(self, file_data: bytes, flash_offset: int) -> bool:
+        """
+        Checks whether the C0-microSD already holds the data at the flash
+        offset, so that flashing it can be skipped.
+
+        :param file_data: A byte buffer with the data to be written
+        :param flash_offset: Device offset (in bytes) for the data
+                             to be written
+        :return: True if the device contents match the data
+        """
+        self._check_flash_preconditions(file_data)
+
+        print("Checking existing data... ", end="", flush=True)
+        if self._verify_data(file_data, flash_offset):
+            print("Data already up to date, skipping flash.")
+            return True
+        print("Data differs.")
+        return False
 
     def flash_and_verify(
-        self, file_data: bytes, flash_offset: int, max_attempts: int
+        self,
+        file_data: bytes,
+        flash_offset: int,
+        max_attempts: int,
+        skip_if_unchanged: bool = True
     ) -> bool:
         """
         Flashes data to the C0-microSD and verifies that the flashing
@@ -129,14 +266,17 @@ class C0microSDToolkit(C0microSDInterface):
         :param flash_offset: Device offset (in bytes) for the data
                              to be written
         :param max_attempts: Maximum failed attempts before aborting operation
+        :param skip_if_unchanged: Do not flash if the device already holds
+                                  the data
         """
-        self.get_status()
+        if skip_if_unchanged:
+            if self.data_is_up_to_date(file_data, flash_offset):
+                return True
+        else:
+            self._check_flash_preconditions(file_data)
 
-        if self.configuration != "bootloader" and not self.force_transactions:
-            raise RuntimeError(
-                "Error: device is not in Bootloader mode. "
-                "Switch to Bootloader mode and try again"
-            )
+        # All writes and compares below take zero-copy slices of this view
+        file_data_view = memoryview(file_data)
 
         input_file_bytes = len(file_data)
         for i in range(1, max_attempts + 1):
@@ -145,42 +285,56 @@ class C0microSDToolkit(C0microSDInterface):
                 end="",
                 flush=True
             )
-            self._write(flash_offset, file_data)
+            for chunk_offset in range(
+                0, input_file_bytes, self.WRITE_CHUNK_SIZE
+            ):
+                self._write(
+                    flash_offset + chunk_offset,
+                    file_data_view[
+                        chunk_offset:chunk_offset + self.WRITE_CHUNK_SIZE
+                    ]
+                )
             print("Verifying...")
-            data_to_verify = self._read(flash_offset, input_file_bytes)
-            if data_to_verify == file_data:
+            if self._verify_data(file_data_view, flash_offset):
                 print("Success: The data matches.")
                 return True
             else:
                 print("Error: The data do not match.")
         return False
 
-    def get_bitstream_prefix(self, bitstream_offset: int) -> bytes:
+    def get_bitstream_prefix(
+            self,
+            bitstream_offset: int,
+            prefix_chunk: Union[None, bytes, bytearray, memoryview] = None
+    ) -> bytes:
         """
         Reads the prefix section of a bitstream
 
         :param offset: Offset of bitstream in flash memory
+        :param prefix_chunk: Data already read from the start of the
+                             bitstream. If None, it is read from the device.
         """
 
-        # We assume that the prefix is never going to be larger than 4K
-        self.get_status()
-        prefix_chunk = self._read(bitstream_offset, 4096)
-
-        prefix_start_word = b'\xFF\x00'
-        prefix_end_word = b'\x00\xFF'
-
-        prefix_start = prefix_chunk.find(prefix_start_word)
-        prefix_end = prefix_chunk.find(prefix_end_word, prefix_start)
+        if prefix_chunk is None:
+            self.get_status()
+            prefix_chunk = self._read(
+                bitstream_offset, self.BITSTREAM_PREFIX_CHUNK_SIZE
+            )
 
-        if prefix_start == -1 or prefix_end == -1:
+        try:
+            prefix_start = prefix_chunk.index(_BITSTREAM_PREFIX_START_WORD)
+            prefix_end = prefix_chunk.index(
+                _BITSTREAM_PREFIX_END_WORD,
+                prefix_start + len(_BITSTREAM_PREFIX_START_WORD)
+            )
+        except ValueError:
             raise ValueError("Could not find bitstream prefix section.")
 
-        prefix_end += len(prefix_end_word)
-
-        prefix_data = prefix_chunk[
-            prefix_start + len(prefix_start_word):
-            prefix_end - len(prefix_end_word)
-        ]
+        # Slice through a memoryview so that only the prefix itself is
+        # copied, whatever buffer type the chunk was passed in as.
+        prefix_data = bytes(memoryview(prefix_chunk)[
+            prefix_start + len(_BITSTREAM_PREFIX_START_WORD):prefix_end
+        ])
 
         return prefix_data
 
@@ -189,7 +343,8 @@ class C0microSDToolkit(C0microSDInterface):
             bitstream_offset: int,
             bitstream_crc: int,
             bitstream_prefix_size: int,
-            bitstream_size: int
+            bitstream_size: int,
+            bitstream_chunk: Union[None, bytes, bytearray, memoryview] = None
     ) -> bool:
         """
         Verifies a the crc32 checksum of a bitstream
@@ -197,18 +352,31 @@ class C0microSDToolkit(C0microSDInterface):
         :param bitstream_offset: Offset of bitstream in flash memory
         :param bitstream_crc: Expected crc of bitstream
         :param bitstream_size: Expected size of bitstream in bytes
+        :param bitstream_chunk: Data already read from bitstream_offset.
+                                The part of the bitstream it covers is not
+                                read again from the device.
         """
 
-        bitstream = self._read(
-            bitstream_offset, bitstream_prefix_size + bitstream_size
-        )
+        offset = bitstream_offset + bitstream_prefix_size
+        remaining = bitstream_size
+        actual_crc = 0
 
-        bitstream_data = bitstream[bitstream_prefix_size:]
-        actual_crc = binascii.crc32(bitstream_data) & 0xFFFFFFFF
+        if bitstream_chunk is not None:
+            cached_data = memoryview(bitstream_chunk)[
+                bitstream_prefix_size:bitstream_prefix_size + bitstream_size
+            ]
+            actual_crc = _crc32(cached_data)
+            offset += len(cached_data)
+            remaining -= len(cached_data)
 
-        return actual_crc == bitstream_crc
+        # Stream the rest of the bitstream in chunks
+        for chunk in self._iter_read(offset, remaining, self.READ_CHUNK_SIZE):
+            actual_crc = _crc32(chunk, actual_crc)
+            remaining -= len(chunk)
 
-    def print_bitstream_information(self, offset) -> None:
+        return remaining == 0 and actual_crc == bitstream_crc
+
+    def print_bitstream_information(self, offset: int) -> None:
         """
         Reads and prints bitstream prefix from a specific offset in the
         device. Also runs crc verification if prefix is in json format and
@@ -218,41 +386,55 @@ class C0microSDToolkit(C0microSDInterface):
         :param bitstream_crc: Expected crc of bitstream
         :param bitstream_size: Expected size of bitstream in bytes
         """
-        bitstream_prefix_data = self.get_bitstream_prefix(offset)
+        # Read the start of the bitstream once, and share it between the
+        # prefix lookup and the crc verification.
+        self.get_status()
+        bitstream_chunk = self._read(offset, self.BITSTREAM_PREFIX_CHUNK_SIZE)
+        bitstream_prefix_data = self.get_bitstream_prefix(
+            offset, bitstream_chunk
+        )
 
-        bitstream_prefix_string = bitstream_prefix_data.decode('utf-8')
+        bitstream_prefix_string = bitstream_prefix_data.decode(
+            'utf-8', errors='replace'
+        )
 
         print(f"    Bitstream prefix section: {bitstream_prefix_string}")
 
         try:
-            prefix_json = json.loads(bitstream_prefix_string)
-            bitstream_crc = prefix_json["bitstream_crc"]
-            bitstream_size = prefix_json["bitstream_size"]
-            crc_pass = self.verify_bitstream_crc(
-                offset,
-                bitstream_crc,
-                len(bitstream_prefix_data) + 4,
-                bitstream_size
-            )
+            prefix_json = _json_loads(bitstream_prefix_data)
+        except ValueError:
+            prefix_json = None
 
-            if crc_pass:
-                print("    Bitstream CRC verification: PASS")
-            else:
-                print("    Bitstream CRC verification: FAIL")
-        except ValueError or KeyError:
+        bitstream_crc = None
+        bitstream_size = None
+        if isinstance(prefix_json, dict):
+            bitstream_crc = prefix_json.get("bitstream_crc")
+            bitstream_size = prefix_json.get("bitstream_size")
+
+        if bitstream_crc is None or bitstream_size is None:
             print("    Unable to parse prefix for CRC verification")
+            return
+
+        crc_pass = self.verify_bitstream_crc(
+            offset,
+            bitstream_crc,
+            len(bitstream_prefix_data) + 4,
+            bitstream_size,
+            bitstream_chunk
+        )
+
+        if crc_pass:
+            print("    Bitstream CRC verification: PASS")
+        else:
+            print("    Bitstream CRC verification: FAIL")
 
     def verify_warmboot_section(self) -> bool:
-        warmboot_section = self._read(0, 5*32).hex()
-        warmboot_section_template = str(
-            "7eaa997e92000044030800008200000108000000000000000000000000000000"
-            "7eaa997e92000044030800008200000108000000000000000000000000000000"
-            "7eaa997e92000044031000008200000108000000000000000000000000000000"
-            "7eaa997e92000044031800008200000108000000000000000000000000000000"
-            "7eaa997e92000044030800008200000108000000000000000000000000000000"
-        )
+        """
+        Verifies that the warmboot section matches the expected template.
+        """
+        warmboot_section = self._read(0, len(self.WARMBOOT_SECTION_TEMPLATE))
 
-        return warmboot_section == warmboot_section_template
+        return warmboot_section == self.WARMBOOT_SECTION_TEMPLATE
 
     def get_serial_number(self) -> str:
         serial_number_section = self._read(
@@ -262,9 +444,9 @@ class C0microSDToolkit(C0microSDInterface):
             serial_number_section, 0xFF
         )
 
-        serial_number_section = ''.join(
-            to_printable(byte) for byte in serial_number_section
-        )
+        serial_number_section = serial_number_section.translate(
+            _PRINTABLE_TABLE
+        ).decode('ascii')
         return serial_number_section
 
     def get_uuid(self) -> str:
@@ -275,13 +457,39 @@ class C0microSDToolkit(C0microSDInterface):
             uuid_section, 0xFF
         )
 
-        uuid_section = ''.join(
-            to_printable(byte) for byte in uuid_section
-        )
+        uuid_section = uuid_section.translate(
+            _PRINTABLE_TABLE
+        ).decode('ascii')
         return uuid_section
 
 
-def to_printable(byte: bytearray) -> str:
+# Flash targets selected by the command-line options, mapped to
+# (description, device offset, bootloader unlock required)
+_FLASH_TARGETS = {
+    "user_bitstream": (
+        "custom user bitstream",
+        C0microSDToolkit.USER_BITSTREAM_OFFSET,
+        False
+    ),
+    "user_data": (
+        "user data bitstream",
+        C0microSDToolkit.USER_DATA_OFFSET,
+        False
+    ),
+    "bootloader": (
+        "bootloader bitstream",
+        C0microSDToolkit.BOOTLOADER_BITSTREAM_OFFSET,
+        True
+    ),
+    "soc": (
+        "Signaloid SoC bitstream",
+        C0microSDToolkit.SOC_BITSTREAM_OFFSET,
+        True
+    ),
+}
+
+
+def to_printable(byte: int) -> str:
     """
     Decode byte to character using UTF-8 encoding.
     Decode anything that is not UTF-8 as '.'
@@ -289,6 +497,10 @@ def to_printable(byte: bytearray) -> str:
     return chr(byte) if 32 <= byte <= 126 else '.'
 
 
+# Translation table applying to_printable() to every byte value
+_PRINTABLE_TABLE = bytes(ord(to_printable(byte)) for byte in range(256))
+
+
 def confirm_action() -> bool:
     """
     Prompts the user to accept/reject action
@@ -309,7 +521,7 @@ def confirm_action() -> bool:
             print("Invalid input. Please enter 'y' for yes or 'n' for no.")
 
 
-def parse_size(size_str):
+def parse_size(size_str: str) -> int:
     """
     Parses a size string with optional suffixes (K, M, G)
     and converts it to bytes.
@@ -317,25 +529,201 @@ def parse_size(size_str):
     :param size_str: Size string (e.g., '1K', '5M', '3G')
     :return: Size in bytes as an integer
     """
-    match = re.match(r"(\d+)([KMG]?)", size_str.upper())
+    match = _SIZE_RE.fullmatch(size_str)
     if not match:
         raise ValueError("Invalid padding size format. "
                          "Use a number or a number with suffix (K, M, G).")
 
     size = int(match.group(1))
-    suffix = match.group(2)
+    suffix = match.group(2).upper()
+
+    return size << _SIZE_SUFFIX_SHIFT[suffix]
+
+
+def map_exceptions(function: Callable) -> Callable:
+    """
+    Decorator that reports any exception raised by the decorated function
+    and exits with the matching os.EX_* exit code.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            print(f"{e}\nAn error occurred, aborting.", file=sys.stderr)
+            for exception_type, exit_code in _EXIT_CODES:
+                if isinstance(e, exception_type):
+                    exit(exit_code)
+            exit(os.EX_SOFTWARE)
+    return wrapper
+
+
+def open_and_pad_file(
+        input_file: str, pad_size: Union[None, int]
+        ) -> Union[bytes, bytearray, mmap.mmap]:
+    """
+    Reads an input file into memory, and pads it with zeros to pad_size.
+
+    :param input_file: Path of the input file
+    :param pad_size: Target size in bytes, or None for no padding
+    :return: The (padded) file data, as a read-only mapping of the file
+             when it is a regular file and no padding is applied
+    """
+    try:
+        with open(input_file, "rb") as src:
+            file_stat = os.fstat(src.fileno())
+            if (not stat.S_ISREG(file_stat.st_mode)
+                    or file_stat.st_size == 0):
+                # Pipes, character devices and procfs/sysfs-style files
+                # report no size up front, so read the stream to its end.
+                file_data = src.read()
+                file_size = len(file_data)
+                if pad_size is not None and pad_size > file_size:
+                    file_data = bytearray(file_data)
+                    file_data.extend(bytes(pad_size - file_size))
+            elif (pad_size or 0) <= file_stat.st_size:
+                # No padding needed: map the file instead of copying it.
+                # The mapping stays valid after the file is closed.
+                file_size = file_stat.st_size
+                file_data = mmap.mmap(
+                    src.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            else:
+                # Read straight into a zero-filled buffer of the final
+                # size, so that padding needs no further copies.
+                file_size = file_stat.st_size
+                file_data = bytearray(max(file_size, pad_size or 0))
+                read_size = src.readinto(memoryview(file_data)[:file_size])
+                if read_size != file_size:
+                    raise RuntimeError(
+                        f"Error: Read {read_size} of {file_size} bytes "
+                        f"from {input_file}."
+                    )
+    except PermissionError:
+        raise PermissionError(
+            "Permission denied: You do not have the "
+            f"necessary permissions to access {input_file}."
+        )
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"File not found: The file {input_file} does not exist."
+        )
+
+    print("Filename: ", input_file)
+    print("File size: ", file_size, "bytes.")
+
+    if pad_size is not None and pad_size > file_size:
+        print(f"Input file padded to {pad_size} bytes.")
+    elif pad_size is not None and pad_size < file_size:
+        print("Warning: The specified padding size is smaller than the "
+              "input file size. No padding applied.")
+
+    return file_data
+
+
+@map_exceptions
+def handle_command(
+        parser: "argparse.ArgumentParser", args: "argparse.Namespace"
+        ) -> None:
+    """
+    Runs the toolkit command selected by the command-line arguments.
+
+    :param parser: The command-line argument parser
+    :param args: The parsed command-line arguments
+    """
+    # Create a new toolkit object
+    toolkit = C0microSDToolkit(
+        args.target_device, force_transactions=args.force_flash
+    )
+
+    # Get status of the C0-microSD, also used to verify that communication
+    # is correct, and that the C0-microSD is in bootloader mode.
+    toolkit.get_status()
+
+    print(toolkit)
+
+    # Print additional information and exit
+    if args.print_information:
+        if toolkit.configuration != "bootloader":
+            print("Device is not in Bootloader mode.")
+            print(
+                "To display device Serial Number, device UUID, and verify "
+                "the bitstream and warmboot sections \nof the "
+                "non-volatile memory, switch to Bootloader mode and "
+                "try again."
+            )
+            print("Done.")
+            exit(os.EX_OK)
+
+        print(f"Device Serial Number: {toolkit.get_serial_number()}")
+        print(f"Device UUID: {toolkit.get_uuid()}")
+        print()
+        print("Reading Bootloader bitstream:")
+        toolkit.print_bitstream_information(
+            toolkit.BOOTLOADER_BITSTREAM_OFFSET)
+        print("Reading Signaloid SoC bitstream:")
+        toolkit.print_bitstream_information(
+            toolkit.SOC_BITSTREAM_OFFSET)
+        if (toolkit.verify_warmboot_section()):
+            print("Warmboot section verification: PASS")
+        else:
+            print("Warmboot section verification: FAIL")
+        print("Done.")
+        exit(os.EX_OK)
+
+    # This is the time to switch boot mode if needed.
+    if args.switch_boot_mode:
+        toolkit.switch_boot_config()
+        print("Done.")
+        exit(os.EX_OK)
+
+    # All commands after this point need an input file
+    if not args.input_file:
+        parser.print_help()
+        print("\nOption -b is required when flashing data.")
+        sys.exit(os.EX_USAGE)
 
-    if suffix == 'K':
-        return size * 1024
-    elif suffix == 'M':
-        return size * (1024 ** 2)
-    elif suffix == 'G':
-        return size * (1024 ** 3)
-    else:
-        return size
+    # Parse the pad size if provided
+    pad_size = None
+    if args.pad_size is not None:
+        pad_size = parse_size(args.pad_size)
 
+    # Open the input file and store (padded) data in memory.
+    file_data = open_and_pad_file(args.input_file, pad_size)
+
+    description, flash_offset, protected = _FLASH_TARGETS[args.flash_target]
+
+    # Compare before prompting and unlocking, so that an unchanged image
+    # needs neither
+    if not args.rewrite and toolkit.data_is_up_to_date(
+        file_data, flash_offset
+    ):
+        print("Done.")
+        return
+
+    if protected:
+        if not confirm_action():
+            print("Aborting.")
+            exit(os.EX_USAGE)
+        toolkit.unlock_bootloader()
+
+    try:
+        print(f"Flashing {description}...")
+        toolkit.flash_and_verify(
+            file_data,
+            flash_offset,
+            MAX_FLASH_ATTEMPTS,
+            skip_if_unchanged=False
+        )
+    finally:
+        if protected:
+            toolkit.lock_bootloader()
+    print("Done.")
+
+
+def main() -> None:
+    import argparse
 
-def main():
     parser = argparse.ArgumentParser(
         description=f"Signaloid C0-microSD-toolkit. Version {APP_VERSION}",
         add_help=False
@@ -371,20 +759,23 @@ def main():
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
         "-u",
-        dest="flash_user_data",
-        action="store_true",
+        dest="flash_target",
+        action="store_const",
+        const="user_data",
         help="Flash user data."
     )
     group.add_argument(
         "-q",
-        dest="flash_bootloader",
-        action="store_true",
+        dest="flash_target",
+        action="store_const",
+        const="bootloader",
         help="Flash new Bootloader bitstream."
     )
     group.add_argument(
         "-w",
-        dest="flash_signaloid_soc",
-        action="store_true",
+        dest="flash_target",
+        action="store_const",
+        const="soc",
         help="Flash new Signaloid SoC bitstream."
     )
     group.add_argument(
@@ -406,141 +797,19 @@ def main():
         action="store_true",
         help="Force flash sequence (do not check for bootloader).",
     )
+    parser.add_argument(
+        "-r",
+        dest="rewrite",
+        action="store_true",
+        help="Flash even if the device already holds the input data.",
+    )
 
-    args = parser.parse_args()
-
-    # Create a new toolkit instance
-    try:
-        # Create a new toolkit object
-        toolkit = C0microSDToolkit(
-            args.target_device, force_transactions=args.force_flash
-        )
-
-        # Get status of the C0-microSD, also used to verify that communication
-        # is correct, and that the C0-microSD is in bootloader mode.
-        toolkit.get_status()
-
-        print(toolkit)
-
-        # Print additional information and exit
-        if args.print_information:
-            if toolkit.configuration != "bootloader":
-                print("Device is not in Bootloader mode.")
-                print(
-                    "To display device Serial Number, device UUID, and verify "
-                    "the bitstream and warmboot sections \nof the "
-                    "non-volatile memory, switch to Bootloader mode and "
-                    "try again."
-                )
-                print("Done.")
-                exit(os.EX_OK)
-
-            print(f"Device Serial Number: {toolkit.get_serial_number()}")
-            print(f"Device UUID: {toolkit.get_uuid()}")
-            print()
-            print("Reading Bootloader bitstream:")
-            toolkit.print_bitstream_information(
-                toolkit.BOOTLOADER_BITSTREAM_OFFSET)
-            print("Reading Signaloid SoC bitstream:")
-            toolkit.print_bitstream_information(
-                toolkit.SOC_BITSTREAM_OFFSET)
-            toolkit.verify_warmboot_section()
-            if (toolkit.verify_warmboot_section()):
-                print("Warmboot section verification: PASS")
-            else:
-                print("Warmboot section verification: FAIL")
-            print("Done.")
-            exit(os.EX_OK)
-
-        # This is the time to switch boot mode if needed.
-        if args.switch_boot_mode:
-            toolkit.switch_boot_config()
-            print("Done.")
-            exit(os.EX_OK)
-
-        # All commands after this point need an input file
-        if not args.input_file:
-            parser.print_help()
-            print("\nOption -b is required when flashing data.")
-            sys.exit(os.EX_USAGE)
+    # Flash the custom user bitstream unless another target is selected
+    parser.set_defaults(flash_target="user_bitstream")
 
-        # Open the input file and store data in memory.
-        file_data = None
-        try:
-            with open(args.input_file, "rb") as src:
-                file_data = src.read()
-        except PermissionError:
-            raise PermissionError(
-                "Permission denied: You do not have the "
-                f"necessary permissions to access {args.input_file}."
-            )
-        except FileNotFoundError:
-            raise FileNotFoundError(
-                f"File not found: The file {args.input_file} does not exist."
-            )
+    args = parser.parse_args()
 
-        print("Filename: ", args.input_file)
-        print("File size: ", len(file_data), "bytes.")
-
-        # Parse the pad size if provided
-        pad_size = None
-        if args.pad_size is not None:
-            pad_size = parse_size(args.pad_size)
-
-        if pad_size is not None and pad_size > len(file_data):
-            # Pad the content with zeros
-            file_data = file_data + (b'\x00' * (pad_size - len(file_data)))
-            print(f"Input file padded to {pad_size} bytes.")
-        elif pad_size is not None and pad_size < len(file_data):
-            print("Warning: The specified padding size is smaller than the "
-                  "input file size. No padding applied.")
-
-        if args.flash_bootloader:
-            if not confirm_action():
-                print("Aborting.")
-                exit(os.EX_USAGE)
-            toolkit.unlock_bootloader()
-            print("Flashing bootloader bitstream...")
-            toolkit.flash_and_verify(
-                file_data, toolkit.BOOTLOADER_BITSTREAM_OFFSET,
-                MAX_FLASH_ATTEMPTS
-            )
-            toolkit.lock_bootloader
-        elif args.flash_signaloid_soc:
-            if not confirm_action():
-                print("Aborting.")
-                exit(os.EX_USAGE)
-            toolkit.unlock_bootloader()
-            print("Flashing Signaloid SoC bitstream...")
-            toolkit.flash_and_verify(
-                file_data,
-                toolkit.SOC_BITSTREAM_OFFSET,
-                MAX_FLASH_ATTEMPTS
-            )
-            toolkit.lock_bootloader
-        elif args.flash_user_data:
-            print("Flashing user data bitstream...")
-            toolkit.flash_and_verify(
-                file_data,
-                toolkit.USER_DATA_OFFSET,
-                MAX_FLASH_ATTEMPTS
-            )
-        else:
-            print("Flashing custom user bitstream...")
-            toolkit.flash_and_verify(
-                file_data, toolkit.USER_BITSTREAM_OFFSET, MAX_FLASH_ATTEMPTS
-            )
-        print("Done.")
-    except Exception as e:
-        print(f"{e}\nAn error occurred, aborting.", file=sys.stderr)
-        if isinstance(e, ValueError):
-            exit(os.EX_DATAERR)
-        elif isinstance(e, FileNotFoundError):
-            exit(os.EX_NOINPUT)
-        elif isinstance(e, PermissionError):
-            exit(os.EX_NOPERM)
-        else:
-            exit(os.EX_SOFTWARE)
+    handle_command(parser, args)
 
 
 if __name__ == "__main__":
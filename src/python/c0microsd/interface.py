@@ -20,8 +20,11 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import functools
+import os
 import struct
 import time
+from typing import Callable, Final, Iterator, Tuple, Union
 
 SIGNALOID_SOC_STATUS_WAIT_FOR_COMMAND = 0
 SIGNALOID_SOC_STATUS_CALCULATING = 1
@@ -30,6 +33,23 @@ SIGNALOID_SOC_STATUS_INVALID_COMMAND = 3
 
 K_CALCULATE_NO_COMMAND = 0
 
+# Bounds, in seconds, of the backoff used while waiting for the device to
+# return to SIGNALOID_SOC_STATUS_WAIT_FOR_COMMAND
+_IDLE_POLL_MIN_SLEEP = 1e-4
+_IDLE_POLL_MAX_SLEEP = 0.01
+
+# Seconds between status polls while the SoC is calculating, and while it
+# has not yet picked up a newly sent command
+_CALCULATING_POLL_SLEEP = 0.5
+_PENDING_POLL_SLEEP = 0.01
+
+
+def _no_progress() -> None:
+    """
+    Progress callback for quiet polling, so that the poll loop needs no
+    per-iteration verbose check.
+    """
+
 
 class C0microSDInterface:
     """Communication interface for C0-microSD.
@@ -44,6 +64,12 @@ class C0microSDInterface:
     BOOTLOADER_CHECK_WORD = b"SBLD"
     SOC_CHECK_WORD = b"SSOC"
 
+    # Seconds for which a read configuration status is reused
+    STATUS_CACHE_TIMEOUT = 0.1
+
+    # Little-endian uint32_t register packer
+    _U32 = struct.Struct("<I")
+
     def __init__(
             self, target_device: str,
             force_transactions: bool = False
@@ -57,6 +83,9 @@ class C0microSDInterface:
         self.configuration_switching = False
         self.force_transactions = force_transactions
 
+        # Time of the last successful get_status(), None if invalidated
+        self._status_timestamp = None
+
     def _read(self, offset, bytes) -> bytes:
         """
         Reads data from the C0-microSD.
@@ -64,9 +93,7 @@ class C0microSDInterface:
         :return: The read buffer
         """
         try:
-            with open(self.target_device, "rb") as device:
-                device.seek(offset)
-                return device.read(bytes)
+            fd = os.open(self.target_device, os.O_RDONLY)
         except PermissionError:
             raise PermissionError(
                 "Permission denied: You do not have the "
@@ -78,6 +105,37 @@ class C0microSDInterface:
                 f"Device not found: The device {self.target_device} "
                 "does not exist."
             )
+        # The device is opened per transaction: the last close flushes and
+        # invalidates the block cache, which the device handshake relies on.
+        try:
+            return os.pread(fd, bytes, offset)
+        finally:
+            os.close(fd)
+
+    def _iter_read(
+            self,
+            offset: int,
+            length: int,
+            chunk_size: int = 0x10000
+    ) -> Iterator[bytes]:
+        """
+        Reads a region of the C0-microSD in chunks, so that callers can
+        process each chunk as it arrives instead of holding the whole
+        region in memory.
+
+        :param offset: Offset of the region
+        :param length: Size of the region in bytes
+        :param chunk_size: Maximum size of each read in bytes
+
+        :return: Iterator over the read chunks
+        """
+        end = offset + length
+        while offset < end:
+            chunk = self._read(offset, min(chunk_size, end - offset))
+            if not chunk:
+                return
+            yield chunk
+            offset += len(chunk)
 
     def _write(self, offset, data) -> int:
         """
@@ -86,11 +144,10 @@ class C0microSDInterface:
         :param buffer: The data buffer to write.
         :return: Number of bytes written.
         """
+        # Any write may change the device state
+        self._status_timestamp = None
         try:
-            with open(self.target_device, "wb") as device:
-                device.seek(offset)
-                return device.write(data)
-
+            fd = os.open(self.target_device, os.O_WRONLY)
         except PermissionError:
             raise PermissionError(
                 "Permission denied: You do not have the "
@@ -102,11 +159,31 @@ class C0microSDInterface:
                 f"Device not found: The device {self.target_device} "
                 "does not exist."
             )
+        try:
+            with memoryview(data) as view:
+                # pwrite() may return short, keep writing the remainder
+                written = 0
+                while written < len(view):
+                    written += os.pwrite(
+                        fd, view[written:], offset + written
+                    )
+                return written
+        finally:
+            os.close(fd)
 
     def get_status(self) -> None:
         """
-        Reads configuration status from the C0-microSD.
+        Reads configuration status from the C0-microSD. A status read less
+        than STATUS_CACHE_TIMEOUT seconds ago, with no write since, is
+        reused instead of reading the device again.
         """
+        if (
+            self._status_timestamp is not None and
+            time.monotonic() - self._status_timestamp
+            < self.STATUS_CACHE_TIMEOUT
+        ):
+            return
+
         data = self._read(self.DEVICE_CONFIGURATION_STATUS_OFFSET, 12)
 
         # Decode configuration id register
@@ -129,7 +206,7 @@ class C0microSDInterface:
         self.configuration_version = (major_version, minor_version)
 
         # Decode configuration state register
-        self.configuration_state = struct.unpack("I", data[8:12])[0]
+        self.configuration_state = self._U32.unpack_from(data, 8)[0]
         self.configuration_switching = bool(self.configuration_state & 1)
 
         if self.configuration_switching and not self.force_transactions:
@@ -139,6 +216,8 @@ class C0microSDInterface:
                 "Power-cycle the device and try again."
             )
 
+        self._status_timestamp = time.monotonic()
+
     def __str__(self) -> str:
         value = "Signaloid C0-microSD"
         if self.configuration == "bootloader":
@@ -171,8 +250,8 @@ class C0microSDSignaloidSoCInterface(C0microSDInterface):
     MISO/MOSI buffers, issue commands, and probe the status of the SoC.
     """
 
-    MOSI_BUFFER_SIZE_BYTES = 4096
-    MISO_BUFFER_SIZE_BYTES = 4096
+    MOSI_BUFFER_SIZE_BYTES: Final[int] = 4096
+    MISO_BUFFER_SIZE_BYTES: Final[int] = 4096
 
     STATUS_REGISTER_OFFSET = 0x00000
     SOC_CONTROL_REGISTER_OFFSET = 0x00004
@@ -181,6 +260,9 @@ class C0microSDSignaloidSoCInterface(C0microSDInterface):
     MOSI_BUFFER_OFFSET = 0x50000
     MISO_BUFFER_OFFSET = 0x60000
 
+    # Status and SoC control registers, read together
+    _STATUS_AND_CONTROL = struct.Struct("<2I")
+
     def write_signaloid_soc_MOSI_buffer(self, buffer: bytes) -> None:
         """
         Writes data to the C0-microSD MOSI buffer.
@@ -221,7 +303,7 @@ class C0microSDSignaloidSoCInterface(C0microSDInterface):
         :param value: The uint32_t value to write
         """
         # Pack the uint32_t value into a 4-byte buffer and send it
-        self._write(self.COMMAND_REGISTER_OFFSET, struct.pack("I", value))
+        self._write(self.COMMAND_REGISTER_OFFSET, self._U32.pack(value))
 
     def get_signaloid_soc_status(self) -> int:
         """
@@ -230,14 +312,76 @@ class C0microSDSignaloidSoCInterface(C0microSDInterface):
         :return: The read uint32_t value
         """
         buffer = self._read(self.STATUS_REGISTER_OFFSET, 4)
-        return struct.unpack("I", buffer)[
-            0
-        ]  # Unpack the buffer to get the uint32_t value
+        # Unpack the buffer to get the uint32_t value
+        return self._U32.unpack_from(buffer)[0]
+
+    def get_signaloid_soc_registers(self) -> Tuple[int, int]:
+        """
+        Reads the adjacent C0-microSD status and SoC control registers in a
+        single transaction.
+
+        :return: Tuple of the read (status, SoC control) uint32_t values
+        """
+        buffer = self._read(
+            self.STATUS_REGISTER_OFFSET,
+            self._STATUS_AND_CONTROL.size
+        )
+        return self._STATUS_AND_CONTROL.unpack_from(buffer)
+
+    def _poll_until_done(
+            self,
+            deadline: Union[None, float],
+            timeout: Union[None, float],
+            on_calculating: Callable[[], None]
+    ) -> int:
+        """
+        Polls the SoC status until it leaves the calculating state.
+
+        :param deadline:        time.monotonic() value after which to give
+                                up, or None to wait indefinitely.
+        :param timeout:         The timeout the deadline was derived from,
+                                used in the error message.
+        :param on_calculating:  Callback invoked on every poll that finds
+                                the SoC still calculating, e.g. to report
+                                progress. Pass _no_progress to stay quiet.
+
+        :return: The first status that is not CALCULATING or
+                 WAIT_FOR_COMMAND.
+        """
+        get_status = self.get_signaloid_soc_status
+        monotonic = time.monotonic
+        sleep = time.sleep
+
+        while True:
+            # Get status of Signaloid C0-microSD compute module
+            soc_status = get_status()
+
+            if soc_status == SIGNALOID_SOC_STATUS_CALCULATING:
+                # Signaloid C0-microSD compute module is still calculating
+                poll_sleep = _CALCULATING_POLL_SLEEP
+                on_calculating()
+            elif soc_status == SIGNALOID_SOC_STATUS_WAIT_FOR_COMMAND:
+                # Command not picked up yet
+                poll_sleep = _PENDING_POLL_SLEEP
+            else:
+                return soc_status
+
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining < 0:
+                    raise TimeoutError(
+                        f"Calculation did not finish within {timeout} s."
+                    )
+                # Do not sleep past the deadline
+                poll_sleep = min(poll_sleep, remaining)
+            sleep(poll_sleep)
 
     def calculate_command(
             self,
             command: int,
-            idle_command: int = K_CALCULATE_NO_COMMAND
+            idle_command: int = K_CALCULATE_NO_COMMAND,
+            timeout: Union[None, float] = None,
+            verbose: bool = True
     ) -> bytes:
         """
         Basic command calculation routine. This function sends a command to
@@ -248,36 +392,109 @@ class C0microSDSignaloidSoCInterface(C0microSDInterface):
         :param idle_command:    This is the command that will be sent after the
                                 calculation is complete. The default is
                                 K_CALCULATE_NO_COMMAND
+        :param timeout:         Maximum time in seconds to wait for the
+                                calculation, or None to wait indefinitely.
+                                The return to idle afterwards is separately
+                                bounded by the same amount. If the
+                                calculation times out, the idle command is
+                                still sent before TimeoutError is raised.
+        :param verbose:         Print progress and errors to stdout.
 
         :return: The MISO buffer contents after the command has finished.
         """
         data_buffer = None
 
+        # The block device offers no poll/select readiness, so the wait is
+        # bounded against a monotonic deadline instead.
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+
         self.send_signaloid_soc_command(command)
-        print("Waiting for calculation to finish.", end="")
 
-        while True:
-            # Get status of Signaloid C0-microSD compute module
-            soc_status = self.get_signaloid_soc_status()
+        try:
+            if verbose:
+                print("Waiting for calculation to finish.", end="")
+                try:
+                    soc_status = self._poll_until_done(
+                        deadline,
+                        timeout,
+                        functools.partial(print, ".", end="")
+                    )
+                except TimeoutError:
+                    print()
+                    raise
+            else:
+                soc_status = self._poll_until_done(
+                    deadline, timeout, _no_progress
+                )
+        except TimeoutError:
+            # Do not leave the command latched: the SoC would later report
+            # DONE, and the next calculate_command() would return this
+            # command's result.
+            self.send_signaloid_soc_command(idle_command)
+            raise
 
-            if soc_status == SIGNALOID_SOC_STATUS_CALCULATING:
-                # Signaloid C0-microSD compute module is still calculating
-                print(".", end="")
-                time.sleep(0.5)
-            elif soc_status == SIGNALOID_SOC_STATUS_DONE:
-                # Signaloid C0-microSD completed calculation
+        if soc_status == SIGNALOID_SOC_STATUS_DONE:
+            # Signaloid C0-microSD completed calculation
+            if verbose:
                 print("\nRead data content...")
-                data_buffer = self.read_signaloid_soc_MISO_buffer()
-                break
-            elif soc_status == SIGNALOID_SOC_STATUS_INVALID_COMMAND:
-                print("\nERROR: Device returned 'Unknown CMD'\n")
-                break
-            elif soc_status != SIGNALOID_SOC_STATUS_WAIT_FOR_COMMAND:
-                print("\nERROR: Device returned 'Unknown CMD'\n")
-                break
-
-        while (self.get_signaloid_soc_status()
-               != SIGNALOID_SOC_STATUS_WAIT_FOR_COMMAND):
-            self.send_signaloid_soc_command(idle_command)
+            data_buffer = self.read_signaloid_soc_MISO_buffer()
+        elif verbose:
+            # SIGNALOID_SOC_STATUS_INVALID_COMMAND or an unknown status
+            print("\nERROR: Device returned 'Unknown CMD'\n")
+
+        # The command register latches its value, so the idle command only
+        # needs to be issued once. Poll with exponential backoff until the
+        # device acknowledges it.
+        self.send_signaloid_soc_command(idle_command)
+        # The idle handshake gets its own bound, so that a calculation that
+        # finished just inside the timeout still returns its result.
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        get_status = self.get_signaloid_soc_status
+        monotonic = time.monotonic
+        sleep = time.sleep
+        backoff = _IDLE_POLL_MIN_SLEEP
+        while get_status() != SIGNALOID_SOC_STATUS_WAIT_FOR_COMMAND:
+            if deadline is not None and monotonic() > deadline:
+                raise TimeoutError(
+                    f"Device did not return to idle within {timeout} s."
+                )
+            sleep(backoff)
+            backoff = min(backoff * 2, _IDLE_POLL_MAX_SLEEP)
 
         return data_buffer
+
+    def make_command_runner(
+            self,
+            command: int,
+            idle_command: int = K_CALCULATE_NO_COMMAND,
+            timeout: Union[None, float] = None,
+            verbose: bool = False
+    ) -> Callable[[], bytes]:
+        """
+        Binds a fixed set of calculate_command() arguments, for callers that
+        issue the same command repeatedly.
+
+        :param command:         The C0-microSD command.
+        :param idle_command:    The command sent after the calculation is
+                                complete.
+        :param timeout:         Maximum time in seconds to wait for the
+                                calculation, or None to wait indefinitely.
+                                The return to idle afterwards is separately
+                                bounded by the same amount. If the
+                                calculation times out, the idle command is
+                                still sent before TimeoutError is raised.
+        :param verbose:         Print progress and errors to stdout.
+
+        :return: A callable that runs the command and returns the MISO
+                 buffer contents.
+        """
+        return functools.partial(
+            self.calculate_command,
+            command,
+            idle_command=idle_command,
+            timeout=timeout,
+            verbose=verbose
+        )